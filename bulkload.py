@@ -0,0 +1,384 @@
+"""Bulk import and export of key/value datasets.
+
+Import streams a JSONL or CSV file with bounded memory, partitions records
+by the node that owns them and sends them as pipelined store_batch frames
+over several connections per node. Export pulls every node's keys in
+parallel with dump_keys and writes them to one JSONL stream.
+
+Usage:
+    python bulkload.py import <ip:port> <file> [--format jsonl|csv]
+    python bulkload.py export <ip:port> [<file>|-]
+
+JSONL records are {"key": ..., "value": ...} objects; other objects are
+read as one record per field. CSV rows are key,value, or taken from the
+"key" and "value" columns when the header names them.
+"""
+import argparse
+import bisect
+import csv
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import node as chord
+from transport import TcpTransport
+
+BATCH_BYTES = 64 * 1024  # Target payload per store_batch frame
+BATCH_RECORDS = 1000
+# Largest encoded record that still fits a store_batch frame on its own
+SINGLE_RECORD_BYTES = chord.BATCH_FRAME_LIMIT - len(b'{"items":[]}')
+QUEUE_DEPTH = 8  # Batches buffered per owner before the reader blocks
+
+class RingView:
+    """Client-side snapshot of the ring, built by walking successors"""
+
+    def __init__(self, transport, seed, bits):
+        self.transport = transport
+        self.bits = bits
+        self.nodes = []
+        self.ids = []
+        self.discover(seed)
+
+    def request(self, addr, command):
+        with self.transport.connect(addr, chord.CONNECTION_TIMEOUT * 5) as s:
+            s.send(json.dumps(command).encode())
+            return json.loads(s.recv(4096).decode())
+
+    def discover(self, seed, limit=100000):
+        seen = {}
+        current = tuple(seed)
+        # Positions can move when nodes rebalance, so ask rather than hash
+        current_id = self.request(current, {"command": "ping"}).get("id")
+        while current not in seen and len(seen) < limit:
+            if current_id is None:
+                current_id = chord.hash_function(f"{current[0]}:{current[1]}", self.bits)
+            seen[current] = current_id
+            response = self.request(current, {"command": "find_successor",
+                                              "id": (current_id + 1) % 2 ** self.bits})
+            current = tuple(response["successor"])
+            current_id = response.get("successor_id")
+        ordered = sorted((node_id, addr) for addr, node_id in seen.items())
+        self.ids = [node_id for node_id, _ in ordered]
+        self.nodes = [addr for _, addr in ordered]
+
+    def owner(self, key):
+        key_id = chord.hash_function(key, self.bits)
+        index = bisect.bisect_left(self.ids, key_id)
+        return self.nodes[index % len(self.nodes)]
+
+class Progress:
+    """Thread-safe counters with a periodic one-line report on stderr"""
+
+    def __init__(self, label, interval=1.0):
+        self.label = label
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._report_loop, daemon=True)
+        self.thread.start()
+
+    def add(self, records, size, failed=0):
+        with self.lock:
+            self.records += records
+            self.bytes += size
+            self.failed += failed
+
+    def line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"{self.label}: {self.records} records ({self.failed} failed), "
+                f"{self.records / elapsed:,.0f} rec/s, {self.bytes / elapsed / 1e6:.2f} MB/s, "
+                f"{elapsed:.1f}s")
+
+    def _report_loop(self):
+        while not self.stopped.wait(self.interval):
+            print(f"\r{self.line()}", end="", file=sys.stderr, flush=True)
+
+    def finish(self):
+        self.stopped.set()
+        self.thread.join()
+        print(f"\r{self.line()}", file=sys.stderr)
+
+def read_records(path, fmt):
+    """Yield (key, value) pairs from a JSONL or CSV file, one line at a time"""
+    with open(path, newline="" if fmt == "csv" else None, encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            if "key" in header and "value" in header:
+                key_col, value_col = header.index("key"), header.index("value")
+            else:
+                key_col, value_col = 0, 1
+                yield header[0], header[1]
+            for row in reader:
+                if len(row) > max(key_col, value_col):
+                    yield row[key_col], row[value_col]
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "key" in record and "value" in record:
+                    yield str(record["key"]), record["value"]
+                else:
+                    for key, value in record.items():
+                        yield str(key), value
+
+class BatchSender:
+    """Pipelines store_batch frames to one node over a single connection"""
+
+    def __init__(self, transport, addr, window, progress):
+        self.transport = transport
+        self.addr = addr
+        self.window = window
+        self.progress = progress
+        self.sock = None
+        self.outstanding = deque()
+
+    def connect(self):
+        self.sock = self.transport.connect(self.addr, chord.STREAM_TIMEOUT)
+        self.sock.sendall(json.dumps({"command": "store_batch"}).encode())
+        ready = chord.recv_json_frame(self.sock)
+        if ready.get("status") != "ready":
+            raise ConnectionError(ready.get("message", "store_batch refused"))
+
+    def send(self, batch):
+        self.outstanding.append(batch)
+        if self.sock is None:
+            self.connect()
+        chord.send_frame(self.sock, batch["payload"])
+        if len(self.outstanding) >= self.window:
+            self.collect()
+
+    def collect(self):
+        batch = self.outstanding.popleft()
+        result = chord.recv_json_frame(self.sock)
+        if result.get("status") == "success":
+            self.progress.add(result["stored"], len(batch["payload"]), result["failed"])
+        else:
+            self.progress.add(0, 0, batch["count"])
+
+    def finish(self):
+        if self.sock is None:
+            return
+        while self.outstanding:
+            self.collect()
+        chord.send_frame(self.sock, b"")
+        self.close()
+
+    def fail(self, error):
+        print(f"\nBatch connection to {self.addr} failed: {error}", file=sys.stderr)
+        for batch in self.outstanding:
+            self.progress.add(0, 0, batch["count"])
+        self.outstanding.clear()
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+def send_loop(transport, addr, batches, window, progress):
+    sender = BatchSender(transport, addr, window, progress)
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        try:
+            sender.send(batch)
+        except Exception as e:
+            sender.fail(e)
+    try:
+        sender.finish()
+    except Exception as e:
+        sender.fail(e)
+
+def store_stream(transport, addr, key, data, is_json=False):
+    uploader = chord.StreamUploader(transport, addr, key, is_json=is_json)
+    try:
+        if uploader.open().get("status") != "ready":
+            return False
+        uploader.write(data)
+        return uploader.close().get("status") == "success"
+    except Exception:
+        return False
+    finally:
+        uploader.abort()
+
+def retrieve_stream(transport, addr, key):
+    """Fetch a streamed value from addr, or None if it cannot be read"""
+    try:
+        with transport.connect(addr, chord.STREAM_TIMEOUT) as s:
+            s.sendall(json.dumps({"command": "retrieve_key", "key": key, "stream": True}).encode())
+            if chord.recv_json_frame(s).get("status") != "success":
+                return None
+            chunks = []
+            while True:
+                chunk = chord.recv_frame(s)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+    except Exception:
+        return None
+
+def encode_batch(items):
+    return {"payload": b'{"items":[' + b",".join(items) + b"]}", "count": len(items)}
+
+def bulk_import(seed, path, fmt, bits, connections, window):
+    transport = TcpTransport()
+    ring = RingView(transport, seed, bits)
+    print(f"Importing into {len(ring.nodes)} nodes", file=sys.stderr)
+    progress = Progress("import")
+
+    queues, workers = {}, []
+    for addr in ring.nodes:
+        queues[addr] = queue.Queue(maxsize=QUEUE_DEPTH)
+        for _ in range(connections):
+            worker = threading.Thread(target=send_loop,
+                                      args=(transport, addr, queues[addr], window, progress),
+                                      daemon=True)
+            worker.start()
+            workers.append(worker)
+
+    # One partially filled batch per owner; full batches block on the owner's
+    # queue, which keeps memory bounded however large the input is
+    pending = {addr: ([], 0) for addr in ring.nodes}
+    oversized = 0
+    for key, value in read_records(path, fmt):
+        addr = ring.owner(key)
+        encoded = json.dumps([key, value]).encode()
+        if len(encoded) > BATCH_BYTES and len(encoded) <= SINGLE_RECORD_BYTES:
+            # Too big to share a frame, but still an ordinary value: a batch
+            # of its own keeps it readable with a plain retrieve_key
+            queues[addr].put(encode_batch([encoded]))
+            continue
+        if len(encoded) > BATCH_BYTES:
+            # Too big for any frame: send it through the chunked stream path
+            is_json = not isinstance(value, str)
+            payload = json.dumps(value) if is_json else value
+            ok = store_stream(transport, addr, key, payload.encode(), is_json)
+            progress.add(1 if ok else 0, len(encoded), 0 if ok else 1)
+            oversized += 1
+            continue
+        items, size = pending[addr]
+        if items and (size + len(encoded) > BATCH_BYTES or len(items) >= BATCH_RECORDS):
+            queues[addr].put(encode_batch(items))
+            items, size = [], 0
+        items.append(encoded)
+        pending[addr] = (items, size + len(encoded) + 1)
+
+    for addr, (items, _) in pending.items():
+        if items:
+            queues[addr].put(encode_batch(items))
+        for _ in range(connections):
+            queues[addr].put(None)
+    for worker in workers:
+        worker.join()
+    progress.finish()
+    if oversized:
+        print(f"{oversized} oversized values were sent as streams", file=sys.stderr)
+    return progress.failed == 0
+
+def bulk_export(seed, out, bits):
+    transport = TcpTransport()
+    ring = RingView(transport, seed, bits)
+    print(f"Exporting from {len(ring.nodes)} nodes", file=sys.stderr)
+    progress = Progress("export")
+    write_lock = threading.Lock()
+    unreadable = []
+
+    def dump(addr):
+        try:
+            with transport.connect(addr, chord.STREAM_TIMEOUT) as s:
+                s.sendall(json.dumps({"command": "dump_keys"}).encode())
+                chord.recv_json_frame(s)
+                streamed = []
+                while True:
+                    frame = chord.recv_frame(s, chord.BATCH_FRAME_LIMIT)
+                    if not frame:
+                        break
+                    batch = json.loads(frame.decode())
+                    if "streamed" in batch:
+                        streamed.extend(batch["streamed"])
+                        continue
+                    items = batch["items"]
+                    lines = "".join(json.dumps({"key": k, "value": v}) + "\n" for k, v in items)
+                    with write_lock:
+                        out.write(lines)
+                    progress.add(len(items), len(frame))
+            # Streamed values are raw bytes, exported as text unless they
+            # were stored as JSON
+            for key, is_json in streamed:
+                data = retrieve_stream(transport, addr, key)
+                if data is None:
+                    unreadable.append(key)
+                    progress.add(0, 0, 1)
+                    continue
+                text = data.decode("utf-8", errors="replace")
+                value = json.loads(text) if is_json else text
+                line = json.dumps({"key": key, "value": value}) + "\n"
+                with write_lock:
+                    out.write(line)
+                progress.add(1, len(data))
+        except Exception as e:
+            print(f"\nExport from {addr} failed: {e}", file=sys.stderr)
+            progress.add(0, 0, 1)
+
+    workers = [threading.Thread(target=dump, args=(addr,), daemon=True) for addr in ring.nodes]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    out.flush()
+    progress.finish()
+    if unreadable:
+        print(f"{len(unreadable)} streamed values could not be read", file=sys.stderr)
+    return progress.failed == 0
+
+def parse_address(text):
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export for the Chord key-value store")
+    sub = parser.add_subparsers(dest="action", required=True)
+
+    imp = sub.add_parser("import", help="load a JSONL or CSV file")
+    imp.add_argument("node", type=parse_address, help="any node in the ring, as ip:port")
+    imp.add_argument("file")
+    imp.add_argument("--format", choices=["jsonl", "csv"])
+    imp.add_argument("--connections", type=int, default=2, help="connections per node")
+    imp.add_argument("--window", type=int, default=4, help="unacknowledged batches per connection")
+
+    exp = sub.add_parser("export", help="dump every key as JSONL")
+    exp.add_argument("node", type=parse_address, help="any node in the ring, as ip:port")
+    exp.add_argument("file", nargs="?", default="-")
+
+    for p in (imp, exp):
+        p.add_argument("--bits", type=int, default=10, help="identifier bits (m) used by the ring")
+    args = parser.parse_args()
+
+    if args.action == "import":
+        fmt = args.format or ("csv" if args.file.endswith(".csv") else "jsonl")
+        ok = bulk_import(args.node, args.file, fmt, args.bits, args.connections, args.window)
+    elif args.file == "-":
+        ok = bulk_export(args.node, sys.stdout, args.bits)
+    else:
+        with open(args.file, "w", encoding="utf-8") as out:
+            ok = bulk_export(args.node, out, args.bits)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
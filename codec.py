@@ -0,0 +1,314 @@
+"""Wire codecs for the single request/response commands.
+
+The legacy protocol sends one JSON object each way. The binary codec
+encodes the hot command set (store_key, retrieve_key, delete_key,
+find_successor, notify, ping, get_predecessor) as a length-prefixed frame:
+
+    marker (0xC4) | version | body length (!I) | opcode | presence bitmap | fields
+
+Ids are fixed-width unsigned 32-bit integers, strings and values are
+length-prefixed bytes, and the bitmap marks which of the command's fields
+follow. Any message the schema cannot express (another command, an extra
+field, an id that does not fit) is sent as opcode 0 carrying JSON inside
+the same frame, so both codecs can carry every message.
+
+Fields are only ever appended to a command's schema. A peer that predates
+a field fails to decode a frame carrying it and closes the connection, so
+the sender falls back to JSON for that peer, where unknown keys are
+ignored.
+
+The codec is chosen per connection by its first byte: a JSON request
+starts with "{", a binary one with the marker, and the server answers in
+the codec the request used.
+
+Usage: python codec.py [--iterations N]  (microbenchmark of both codecs)
+"""
+import argparse
+import json
+import struct
+import time
+
+MARKER = 0xC4
+VERSION = 1
+HEADER = struct.Struct("!BBI")
+MAX_FRAME = 1024 * 1024
+
+_U8 = struct.Struct("!B")
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+
+class CodecError(ValueError):
+    pass
+
+def _pack_id(value):
+    if type(value) is not int:
+        raise TypeError("id must be an int")
+    return _U32.pack(value)
+
+def _pack_str(value):
+    if type(value) is not str:
+        raise TypeError("expected a string")
+    data = value.encode()
+    return _U16.pack(len(data)) + data
+
+def _pack_value(value):
+    # Values are usually strings; anything else travels as JSON
+    if type(value) is str:
+        data, tag = value.encode(), b"\x00"
+    else:
+        data, tag = json.dumps(value).encode(), b"\x01"
+    return tag + _U32.pack(len(data)) + data
+
+def _pack_addr(value):
+    host, port = value
+    data = host.encode()
+    return _U8.pack(len(data)) + data + _U16.pack(port)
+
+def _pack_bool(value):
+    if type(value) is not bool:
+        raise TypeError("expected a bool")
+    return b"\x01" if value else b"\x00"
+
+def _unpack_bytes(body, offset, size):
+    (length,) = size.unpack_from(body, offset)
+    offset += size.size
+    end = offset + length
+    if end > len(body):
+        raise CodecError("Truncated field")
+    return body[offset:end], end
+
+def _unpack_id(body, offset):
+    return _U32.unpack_from(body, offset)[0], offset + 4
+
+def _unpack_str(body, offset):
+    data, offset = _unpack_bytes(body, offset, _U16)
+    return data.decode(), offset
+
+def _unpack_value(body, offset):
+    data, end = _unpack_bytes(body, offset + 1, _U32)
+    return (data.decode() if body[offset] == 0 else json.loads(data)), end
+
+def _unpack_addr(body, offset):
+    host, offset = _unpack_bytes(body, offset, _U8)
+    return [host.decode(), _U16.unpack_from(body, offset)[0]], offset + 2
+
+def _unpack_bool(body, offset):
+    return body[offset] == 1, offset + 1
+
+# Field types: (pack, unpack) pairs
+ID = (_pack_id, _unpack_id)
+STR = (_pack_str, _unpack_str)
+VALUE = (_pack_value, _unpack_value)
+ADDR = (_pack_addr, _unpack_addr)
+BOOL = (_pack_bool, _unpack_bool)
+
+COMMANDS = ["store_key", "retrieve_key", "delete_key", "find_successor",
+            "notify", "ping", "get_predecessor"]
+OPCODES = {command: i + 1 for i, command in enumerate(COMMANDS)}
+
+REQUEST_FIELDS = {
+    "store_key": (("key", STR), ("value", VALUE), ("budget_ms", ID)),
+    "retrieve_key": (("key", STR), ("local", BOOL), ("budget_ms", ID), ("hedged", BOOL)),
+    "delete_key": (("key", STR), ("local", BOOL), ("budget_ms", ID)),
+    "find_successor": (("id", ID), ("budget_ms", ID)),
+    "notify": (("predecessor", ADDR), ("predecessor_id", ID)),
+    "ping": (),
+    "get_predecessor": (),
+}
+
+RESPONSE_FIELDS = {
+    "store_key": (("status", STR), ("message", STR)),
+    "retrieve_key": (("status", STR), ("value", VALUE), ("message", STR), ("stream", BOOL)),
+    "delete_key": (("status", STR), ("message", STR)),
+    "find_successor": (("successor", ADDR), ("successor_id", ID), ("hops", ID)),
+    "notify": (("status", STR), ("old_predecessor", ADDR)),
+    "ping": (("status", STR), ("id", ID)),
+    "get_predecessor": (("predecessor", ADDR), ("predecessor_id", ID)),
+}
+
+def _frame(body):
+    return HEADER.pack(MARKER, VERSION, len(body)) + body
+
+def _encode(opcode, fields, message, skip=()):
+    """Encode message with the schema, or return None if it does not fit"""
+    if len(message) - len(skip) > len(fields):
+        return None
+    bitmap, parts, used = 0, [], len(skip)
+    try:
+        for i, (name, (pack, _)) in enumerate(fields):
+            value = message.get(name)
+            if value is not None:
+                used += 1
+                bitmap |= 1 << i
+                parts.append(pack(value))
+    except (TypeError, ValueError, struct.error):
+        return None
+    # Keys the schema does not know about, or explicit nulls, need JSON
+    if used != len(message):
+        return None
+    return bytes((opcode, bitmap)) + b"".join(parts)
+
+def _decode(fields, body):
+    bitmap, offset = body[1], 2
+    message = {}
+    for i, (name, (_, unpack)) in enumerate(fields):
+        if bitmap & (1 << i):
+            message[name], offset = unpack(body, offset)
+    if offset != len(body):
+        raise CodecError("Trailing bytes in frame")
+    return message
+
+class JsonCodec:
+    """The legacy protocol: one JSON object each way, read with one recv"""
+
+    name = "json"
+
+    def read_frame(self, conn, data):
+        return data
+
+    def encode_request(self, request):
+        return json.dumps(request).encode()
+
+    def decode_request(self, data):
+        return json.loads(data.decode())
+
+    def encode_response(self, command, response):
+        return json.dumps(response).encode()
+
+    def read_response(self, sock, command):
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError("Empty response")
+        return json.loads(data.decode())
+
+class BinaryCodec:
+    """Length-prefixed frames with a compact schema per command"""
+
+    name = "binary"
+
+    def read_frame(self, conn, data):
+        """Complete the frame whose first bytes are data"""
+        while len(data) < HEADER.size:
+            chunk = conn.recv(HEADER.size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-frame")
+            data += chunk
+        marker, version, length = HEADER.unpack_from(data)
+        if marker != MARKER or version != VERSION:
+            raise CodecError(f"Unsupported codec version {version}")
+        if length > MAX_FRAME:
+            raise CodecError(f"Frame of {length} bytes exceeds limit")
+        while len(data) < HEADER.size + length:
+            chunk = conn.recv(HEADER.size + length - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-frame")
+            data += chunk
+        return data
+
+    def encode_request(self, request):
+        command = request.get("command")
+        body = None
+        if command in OPCODES:
+            body = _encode(OPCODES[command], REQUEST_FIELDS[command], request, skip=("command",))
+        if body is None:
+            body = b"\x00" + json.dumps(request).encode()
+        return _frame(body)
+
+    def decode_request(self, data):
+        body = data[HEADER.size:]
+        if not body:
+            raise CodecError("Empty frame")
+        if body[0] == 0:
+            return json.loads(body[1:].decode())
+        if body[0] > len(COMMANDS):
+            raise CodecError(f"Unknown opcode {body[0]}")
+        command = COMMANDS[body[0] - 1]
+        request = _decode(REQUEST_FIELDS[command], body)
+        request["command"] = command
+        return request
+
+    def encode_response(self, command, response):
+        body = None
+        if command in OPCODES:
+            body = _encode(OPCODES[command], RESPONSE_FIELDS[command], response)
+        if body is None:
+            body = b"\x00" + json.dumps(response).encode()
+        return _frame(body)
+
+    def decode_response(self, command, data):
+        body = data[HEADER.size:]
+        if not body:
+            raise CodecError("Empty frame")
+        if body[0] == 0:
+            return json.loads(body[1:].decode())
+        if body[0] != OPCODES.get(command):
+            raise CodecError(f"Response opcode {body[0]} does not match {command}")
+        return _decode(RESPONSE_FIELDS[command], body)
+
+    def read_response(self, sock, command):
+        data = sock.recv(4096)
+        # A peer without the binary codec cannot parse the request and
+        # closes the connection without answering
+        if not data:
+            raise CodecError("Empty response")
+        if data[0] != MARKER:
+            raise CodecError("Peer did not answer in binary")
+        return self.decode_response(command, self.read_frame(sock, data))
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+
+def codec_for(data):
+    """Codec of a connection, from the first bytes the client sent"""
+    return BINARY if data[0] == MARKER else JSON
+
+SAMPLES = [
+    ({"command": "store_key", "key": "user:1042", "value": "alice@example.com"},
+     {"status": "success", "message": "Key stored successfully"}),
+    ({"command": "retrieve_key", "key": "user:1042", "budget_ms": 4870},
+     {"status": "success", "value": "alice@example.com"}),
+    ({"command": "delete_key", "key": "user:1042", "local": True},
+     {"status": "error", "message": "Key not found"}),
+    ({"command": "find_successor", "id": 48213},
+     {"successor": ["10.0.12.1", 8000], "successor_id": 48990, "hops": 3}),
+    ({"command": "notify", "predecessor": ["10.0.12.1", 8000], "predecessor_id": 48990},
+     {"status": "notified", "old_predecessor": ["10.0.7.1", 8000]}),
+    ({"command": "ping"}, {"status": "alive", "id": 48990}),
+    ({"command": "get_predecessor"},
+     {"predecessor": ["10.0.7.1", 8000], "predecessor_id": 47011}),
+]
+
+def benchmark(codec, iterations):
+    """Seconds per request/response round of encoding and decoding"""
+    decode_response = (lambda command, data: json.loads(data.decode())) if codec is JSON \
+        else codec.decode_response
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for request, response in SAMPLES:
+            decoded = codec.decode_request(codec.encode_request(request))
+            decode_response(decoded["command"], codec.encode_response(decoded["command"], response))
+    return (time.perf_counter() - start) / (iterations * len(SAMPLES))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the JSON and binary wire codecs")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    for request, response in SAMPLES:
+        command = request["command"]
+        assert BINARY.decode_request(BINARY.encode_request(request)) == request, command
+        assert BINARY.decode_response(command, BINARY.encode_response(command, response)) == response, command
+
+    print(f"{'command':<16} {'json bytes':>10} {'binary bytes':>13}")
+    for request, response in SAMPLES:
+        command = request["command"]
+        json_size = len(JSON.encode_request(request)) + len(JSON.encode_response(command, response))
+        binary_size = len(BINARY.encode_request(request)) + len(BINARY.encode_response(command, response))
+        print(f"{command:<16} {json_size:>10} {binary_size:>13}")
+    for codec in (JSON, BINARY):
+        per_round = benchmark(codec, args.iterations)
+        print(f"{codec.name}: {per_round * 1e6:.2f} us per request/response encode+decode "
+              f"({1 / per_round:,.0f}/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import random
+import threading
+import time
+from collections import deque
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class Deadline:
+    """Point in time by which a request has to be answered.
+
+    Between nodes a deadline travels as the budget left in milliseconds
+    rather than as a timestamp, since hosts' clocks are not comparable.
+    Each hop starts its own clock on arrival, so the time spent on the wire
+    comes out of the sender's share.
+    """
+
+    def __init__(self, budget):
+        self.expires = time.monotonic() + budget
+
+    @classmethod
+    def from_request(cls, request, default):
+        budget_ms = request.get("budget_ms")
+        return cls(budget_ms / 1000 if isinstance(budget_ms, int) else default)
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def timeout(self, cap=None):
+        """Socket timeout for the next attempt, never past the deadline"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
+        return remaining if cap is None else min(cap, remaining)
+
+    def share(self, attempts):
+        """Equal slice of what is left for one of attempts tries"""
+        return self.timeout() / max(1, attempts)
+
+    def backoff(self, attempt, base):
+        """Sleep before retry number attempt + 1.
+
+        The delay doubles per attempt with jitter. Returns False without
+        sleeping when the delay would leave no time for the retry.
+        """
+        delay = base * 2 ** attempt * random.uniform(0.5, 1.0)
+        if delay * 2 >= self.remaining():
+            return False
+        time.sleep(delay)
+        return True
+
+class LatencyWindow:
+    """Percentiles over the most recent latency samples"""
+
+    def __init__(self, size=256):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct, min_samples=1):
+        """pct-th percentile in seconds, or None with fewer than min_samples"""
+        with self.lock:
+            if len(self.samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
@@ -1,42 +1,51 @@
 import threading
 
-node_id = None
-ip = None
-port = None
-m = 10
-lock = threading.Lock()
-table = []
-finger_starts = []
-
-def init_finger_table(node_node_id, node_ip, node_port, bits=10):
-    global node_id, ip, port, m, finger_starts, table
-    try:
-        node_id = node_node_id
-        ip = node_ip
-        port = node_port
-        m = bits
-        finger_starts = [(node_id + 2**i) % (2**m) for i in range(m)]
-        table = [(node_ip, node_port) for _ in range(m)]
-        return True
-    except Exception as e:
-        print(f"Error initializing finger table: {e}")
+class FingerTable:
+    def __init__(self, node_id, ip, port, bits=10):
+        self.node_id = node_id
+        self.ip = ip
+        self.port = port
+        self.m = bits
+        self.lock = threading.Lock()
+        self.finger_starts = [(node_id + 2**i) % (2**bits) for i in range(bits)]
+        self.table = [(ip, port) for _ in range(bits)]
+        # Alternative nodes in each finger's interval, table[i] first
+        self.candidates = [[(ip, port)] for _ in range(bits)]
+
+    def rebase(self, node_id):
+        """Recompute finger starts after the node moved on the ring"""
+        with self.lock:
+            self.node_id = node_id
+            self.finger_starts = [(node_id + 2**i) % (2**self.m) for i in range(self.m)]
+
+    def update_finger(self, index, node):
+        with self.lock:
+            if 0 <= index < self.m:
+                self.table[index] = node
+                if self.candidates[index][0] != node:
+                    self.candidates[index] = [node]
+                return True
         return False
 
-def update_finger(index, node):
-    with lock:
-        if 0 <= index < m:
-            table[index] = node
-            return True
-    return False
+    def get_finger(self, index):
+        return self.table[index] if 0 <= index < self.m else None
 
-def get_finger(index):
-    return table[index] if 0 <= index < m else None
+    def get_finger_start(self, index):
+        return self.finger_starts[index] if 0 <= index < len(self.finger_starts) else None
 
-def get_finger_start(index):
-    return finger_starts[index] if 0 <= index < len(finger_starts) else None
+    def set_all_fingers(self, fingers):
+        with self.lock:
+            self.table = list(fingers)
+            self.candidates = [[finger] for finger in self.table]
+            return True
+
+    def set_candidates(self, index, nodes):
+        with self.lock:
+            if 0 <= index < self.m and nodes:
+                self.table[index] = nodes[0]
+                self.candidates[index] = list(nodes)
+                return True
+        return False
 
-def set_all_fingers(fingers):
-    global table
-    with lock:
-        table = fingers
-        return True
+    def get_candidates(self, index):
+        return list(self.candidates[index]) if 0 <= index < self.m else []
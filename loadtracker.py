@@ -0,0 +1,79 @@
+import math
+import threading
+import time
+
+class LoadTracker:
+    """Exponentially decayed request counts per key id.
+
+    A steady rate of r requests/s settles at a decayed count of
+    r * half_life / ln 2, which rates() turns back into requests/s.
+    """
+
+    def __init__(self, half_life=60.0):
+        self.half_life = half_life
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.last_decay = time.monotonic()
+
+    def record(self, key_id, weight=1.0):
+        with self.lock:
+            self.counts[key_id] = self.counts.get(key_id, 0.0) + weight
+
+    def decay(self):
+        with self.lock:
+            now = time.monotonic()
+            factor = 0.5 ** ((now - self.last_decay) / self.half_life)
+            self.last_decay = now
+            self.counts = {key_id: count * factor for key_id, count in self.counts.items()
+                           if count * factor >= 0.01}
+
+    def rates(self):
+        self.decay()
+        with self.lock:
+            scale = math.log(2) / self.half_life
+            return {key_id: count * scale for key_id, count in self.counts.items()}
+
+class StoredBytes:
+    """Bytes stored per key id, kept current as keys are written and removed.
+
+    Saves load accounting from re-reading every stored value, most of which
+    may live on disk.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = {}  # key -> (key_id, size)
+        self.by_id = {}
+
+    def _set(self, key, key_id, size):
+        old = self.keys.pop(key, None)
+        if old is not None:
+            remaining = self.by_id[old[0]] - old[1]
+            if remaining:
+                self.by_id[old[0]] = remaining
+            else:
+                del self.by_id[old[0]]
+        if size is not None:
+            self.keys[key] = (key_id, size)
+            self.by_id[key_id] = self.by_id.get(key_id, 0) + size
+
+    def add(self, key, key_id, size):
+        with self.lock:
+            self._set(key, key_id, size)
+
+    def remove(self, key):
+        with self.lock:
+            self._set(key, None, None)
+
+    def rebuild(self, items):
+        """Replace the counts with (key, key_id, size) triples"""
+        with self.lock:
+            self.keys = {}
+            self.by_id = {}
+            for key, key_id, size in items:
+                self._set(key, key_id, size)
+
+    def sizes(self):
+        """Snapshot of {key_id: bytes}"""
+        with self.lock:
+            return dict(self.by_id)
@@ -1,8 +1,8 @@
-import node
+from node import Node, iter_file_chunks
 import sys
 import threading
 
-def menu():
+def menu(node):
     # Simplified menu display
     print("\n╔═══════════════════════════════════════════════════════╗")
     print("║              Chord DHT Key-Value Store                  ║")
@@ -12,9 +12,11 @@ def menu():
     print("║   1   ║ insert|key:value  - Store a key-value pair      ║")
     print("║   2   ║ get|key          - Retrieve a value by key      ║")
     print("║   3   ║ delete|key       - Delete a key-value pair      ║")
-    print("║   4   ║ finger           - Display finger table         ║")
-    print("║   5   ║ info            - Display node information      ║")
-    print("║   6   ║ exit            - Exit the program              ║")
+    print("║   4   ║ putfile|key:path - Stream a file in as a value  ║")
+    print("║   5   ║ getfile|key:path - Stream a value out to a file ║")
+    print("║   6   ║ finger           - Display finger table         ║")
+    print("║   7   ║ info            - Display node information      ║")
+    print("║   8   ║ exit            - Exit the program              ║")
     print("╚═══════╩═════════════════════════════════════════════════╝")
 
     while True:
@@ -24,7 +26,7 @@ def menu():
             if command.startswith("insert|"):
                 _, kv = command.split("|", 1)
                 key, value = kv.split(":", 1)
-                successor = node.find_key_successor(node.hash_function(key))
+                successor = node.find_key_successor(node.hash(key))
                 
                 if successor == (node.ip, node.port):
                     node.store_key_value(key, value)
@@ -40,23 +42,57 @@ def menu():
                     try:
                         print(f"Value: {node.retrieve_value(key)}")
                     except KeyError:
-                        successor = node.find_key_successor(node.hash_function(key))
-                        response = node.remote_retrieve_key(successor, key)
-                        print(f"Value: {response['value']}" if response.get("status") == "success"
-                              else "Not found")
+                        successor = node.find_key_successor(node.hash(key))
+                        response = ({"status": "error", "stream": True} if key in node.blob_index
+                                    else node.remote_retrieve_key(successor, key))
+                        if response.get("status") == "success":
+                            print(f"Value: {response['value']}")
+                        elif response.get("stream"):
+                            print(f"Value is streamed; fetch it with getfile|{key}:<path>")
+                        else:
+                            print("Not found")
                 except Exception as e:
                     print(f"Error: {e}")
 
             elif command.startswith("delete|"):
                 try:
                     _, key = command.split("|", 1)
-                    key_id = node.hash_function(key)
+                    key_id = node.hash(key)
                     successor = node.find_key_successor(key_id)
                     response = node.remote_delete_key(successor, key)
                     print(f"Response: {response}")
                 except Exception as e:
                     print(f"Error deleting key: {e}")
 
+            elif command.startswith("putfile|"):
+                try:
+                    _, kv = command.split("|", 1)
+                    key, path = kv.split(":", 1)
+                    successor = node.find_key_successor(node.hash(key))
+                    with open(path, 'rb') as f:
+                        if successor == (node.ip, node.port):
+                            size = node.store_stream(key, iter_file_chunks(f))
+                            print(f"Success ({size} bytes)")
+                        else:
+                            response = node.remote_store_stream(successor, key, f)
+                            print(f"Success ({response.get('size')} bytes)"
+                                  if response.get("status") == "success"
+                                  else f"Error: {response.get('message')}")
+                except Exception as e:
+                    print(f"Error: {e}")
+
+            elif command.startswith("getfile|"):
+                try:
+                    _, kv = command.split("|", 1)
+                    key, path = kv.split(":", 1)
+                    with open(path, 'wb') as f:
+                        response = node.remote_retrieve_stream((node.ip, node.port), key, f)
+                    print(f"Saved {response['size']} bytes to {path}"
+                          if response.get("status") == "success"
+                          else f"Error: {response.get('message')}")
+                except Exception as e:
+                    print(f"Error: {e}")
+
             elif command == "finger":
                 node.print_finger_table()
 
@@ -83,7 +119,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     ip, port = sys.argv[1], int(sys.argv[2])
-    node.init_node(ip, port)
+    node = Node(ip, port)
     
     if len(sys.argv) == 5:
         node.join((sys.argv[3], int(sys.argv[4])))
@@ -92,8 +128,11 @@ if __name__ == "__main__":
 
     for thread in [
         threading.Thread(target=node.serve_forever, daemon=True),
-        threading.Thread(target=node.fix_fingers, daemon=True)
+        threading.Thread(target=node.fix_fingers, daemon=True),
+        threading.Thread(target=node.stabilize_loop, daemon=True),
+        threading.Thread(target=node.rebalance_loop, daemon=True),
+        threading.Thread(target=node.anti_entropy_loop, daemon=True)
     ]:
         thread.start()
 
-    menu()
+    menu(node)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+
+MERKLE_DEPTH = 10  # Leaf buckets = 2**depth (at most one per ring id)
+
+def key_digest(key, value):
+    """64-bit digest of one key/value pair"""
+    data = json.dumps([key, value], sort_keys=True).encode()
+    return int.from_bytes(hashlib.sha1(data).digest()[:8], "big")
+
+def _combine(left, right):
+    if not left and not right:
+        return 0
+    data = left.to_bytes(8, "big") + right.to_bytes(8, "big")
+    return int.from_bytes(hashlib.sha1(data).digest()[:8], "big")
+
+def _segments(start, end, size):
+    """Ring range (start, end] as inclusive linear [lo, hi] segments"""
+    if start == end:
+        return [(0, size - 1)]
+    if start < end:
+        return [(start + 1, end)]
+    segments = [(0, end)]
+    if start + 1 < size:
+        segments.append((start + 1, size - 1))
+    return segments
+
+class MerkleTree:
+    """Hash tree over stored keys, bucketed by key id.
+
+    The leaves split the id space into 2**depth buckets. A leaf's hash is
+    the XOR of its keys' digests, so a store or delete updates it in O(1)
+    and only marks the path above it stale; internal hashes are
+    recomputed when a digest is asked for. Digests can be restricted to a
+    ring range (start, end], which lets two nodes compare just the keys
+    one of them owns.
+    """
+
+    def __init__(self, bits, depth=MERKLE_DEPTH):
+        self.bits = bits
+        self.depth = min(depth, bits)
+        self.size = 2 ** bits
+        self.shift = bits - self.depth
+        self.lock = threading.Lock()
+        self.buckets = [{} for _ in range(2 ** self.depth)]  # key -> (key_id, digest)
+        # levels[l][i] is the hash of node i at level l; level depth holds the leaves
+        self.levels = [[0] * (2 ** level) for level in range(self.depth + 1)]
+        self.stale = set()  # leaves changed since internal hashes were computed
+
+    def _set(self, key, key_id, digest):
+        index = key_id >> self.shift
+        bucket = self.buckets[index]
+        old = bucket.pop(key, None)
+        leaves = self.levels[self.depth]
+        if old is not None:
+            leaves[index] ^= old[1]
+        if digest is not None:
+            bucket[key] = (key_id, digest)
+            leaves[index] ^= digest
+        self.stale.add(index)
+
+    def add(self, key, key_id, value):
+        digest = key_digest(key, value)
+        with self.lock:
+            self._set(key, key_id, digest)
+
+    def remove(self, key, key_id):
+        with self.lock:
+            self._set(key, key_id, None)
+
+    def rebuild(self, items):
+        """Replace the tree's contents with (key, key_id, value) triples"""
+        with self.lock:
+            self.buckets = [{} for _ in range(2 ** self.depth)]
+            self.levels = [[0] * (2 ** level) for level in range(self.depth + 1)]
+            self.stale = set()
+            for key, key_id, value in items:
+                self._set(key, key_id, key_digest(key, value))
+
+    def _refresh(self):
+        indexes = self.stale
+        self.stale = set()
+        for level in range(self.depth - 1, -1, -1):
+            indexes = {i // 2 for i in indexes}
+            below, here = self.levels[level + 1], self.levels[level]
+            for i in indexes:
+                here[i] = _combine(below[2 * i], below[2 * i + 1])
+
+    def _node_hash(self, level, index, segments):
+        span = self.bits - level
+        lo, hi = index << span, ((index + 1) << span) - 1
+        if any(seg_lo <= lo and hi <= seg_hi for seg_lo, seg_hi in segments):
+            return self.levels[level][index]
+        if not any(seg_lo <= hi and lo <= seg_hi for seg_lo, seg_hi in segments):
+            return 0
+        if level == self.depth:
+            # Bucket straddles a range boundary: XOR just the keys inside
+            digest = 0
+            for key_id, value_digest in self.buckets[index].values():
+                if any(seg_lo <= key_id <= seg_hi for seg_lo, seg_hi in segments):
+                    digest ^= value_digest
+            return digest
+        return _combine(self._node_hash(level + 1, 2 * index, segments),
+                        self._node_hash(level + 1, 2 * index + 1, segments))
+
+    def hashes(self, level, indexes, start, end):
+        """Hashes of the given nodes at level, counting only keys in (start, end]"""
+        segments = _segments(start, end, self.size)
+        with self.lock:
+            self._refresh()
+            return [self._node_hash(level, index, segments) for index in indexes]
+
+    def digests(self, indexes, start, end):
+        """{key: digest} for keys in the given leaf buckets and in (start, end]"""
+        segments = _segments(start, end, self.size)
+        with self.lock:
+            return {
+                key: digest
+                for index in indexes
+                for key, (key_id, digest) in self.buckets[index].items()
+                if any(lo <= key_id <= hi for lo, hi in segments)
+            }
@@ -0,0 +1,266 @@
+"""Run one Chord node as several worker processes sharing its port.
+
+Every worker binds ip:port with SO_REUSEPORT, so the kernel spreads incoming
+connections across them and JSON parsing, hashing and store access run on
+as many cores as there are workers. Keys are partitioned by
+key_id % workers, and each worker keeps its own shard of the node's data
+files. A request that lands on the wrong worker is not proxied: the
+accepted socket itself, with the bytes already read from it, is passed to
+the owning worker over a Unix datagram socket (SCM_RIGHTS), and that worker
+answers the client directly.
+
+Worker 0 owns the ring membership: it joins, handles notify and
+get_predecessor, and runs stabilize and fix_fingers. The other workers copy its routing
+state every SYNC_INTERVAL seconds, so to the rest of the ring the workers
+look like a single node. Load-aware rebalancing and anti-entropy handover
+are off in this mode, since no single worker sees the whole node's load or
+keys; neighbors asking to move a boundary are turned down.
+
+Data written in single-process mode is not read by the sharded files;
+move it across with bulkload.py export/import.
+
+Usage: python multinode.py <ip> <port> [--workers N] [<known_ip> <known_port>]
+"""
+import argparse
+import array
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import node as chord
+from node import Node
+from transport import TcpTransport
+
+SYNC_INTERVAL = 0.5
+HANDOFF_BYTES = 8192  # Largest request that can be handed to a sibling in one datagram
+KEYED_COMMANDS = {"store_key", "retrieve_key", "delete_key"}
+# Ring membership lives on worker 0 so there is one predecessor to update
+CONTROL_COMMANDS = {"notify", "get_predecessor", "get_successor_list",
+                    "move_position", "accept_range", "transfer_done"}
+
+class ReusePortTransport(TcpTransport):
+    def listen(self, addr, backlog=5):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind(addr)
+        server_socket.listen(backlog)
+        return server_socket
+
+class ShardedNode(Node):
+    """One worker process of a multi-process node"""
+
+    def __init__(self, node_ip, node_port, worker, workers, sock_dir, node_m=10,
+                 data_dir=chord.DATA_STORE_DIR):
+        super().__init__(node_ip, node_port, node_m, transport=ReusePortTransport(),
+                         data_dir=data_dir, shard=worker)
+        self.worker = worker
+        self.workers = workers
+        self.sock_dir = sock_dir
+        self.handoff_sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.handoffs = 0
+        self.rebalancing_enabled = False
+        self.anti_entropy_enabled = False
+
+    def handoff_path(self, worker):
+        return os.path.join(self.sock_dir, f"w{worker}.handoff")
+
+    def rpc_path(self, worker):
+        return os.path.join(self.sock_dir, f"w{worker}.rpc")
+
+    def shard_of(self, key):
+        return self.hash(key) % self.workers
+
+    def route_request(self, conn, request, data):
+        command = request.get("command")
+        if command in KEYED_COMMANDS:
+            target = self.shard_of(request["key"])
+        elif command in CONTROL_COMMANDS:
+            target = 0
+        else:
+            return False
+        if target == self.worker:
+            return False
+        if len(data) > HANDOFF_BYTES:
+            # Too big for one handoff datagram; store_key_value still
+            # forwards the write to the owning worker
+            return False
+        try:
+            # socket.send_fds ignores its address argument, so call sendmsg
+            self.handoff_sender.sendmsg(
+                [data],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [conn.fileno()]))],
+                0, self.handoff_path(target))
+            self.handoffs += 1
+            return True
+        except OSError as e:
+            # Sibling not up yet (or gone): serving here beats dropping it
+            print(f"Handoff to worker {target} failed, serving locally: {e}")
+            return False
+
+    def receive_handoffs(self):
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self.handoff_path(self.worker))
+        while self.running:
+            try:
+                data, fds, _, _ = socket.recv_fds(receiver, HANDOFF_BYTES, 1)
+                if not fds:
+                    continue
+                conn = socket.socket(fileno=fds[0])
+                thread = threading.Thread(target=self.handle_client_request,
+                                          args=(conn, data), daemon=True)
+                thread.start()
+            except Exception as e:
+                print(f"Error receiving handoff: {e}")
+
+    def serve_rpc(self):
+        """Serve the normal protocol to sibling workers over a Unix socket"""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.rpc_path(self.worker))
+        listener.listen(16)
+        while self.running:
+            try:
+                conn, _ = listener.accept()
+                threading.Thread(target=self.handle_client_request,
+                                 args=(conn,), daemon=True).start()
+            except Exception as e:
+                print(f"Error in worker RPC server: {e}")
+
+    def sibling(self, worker, timeout=chord.STREAM_TIMEOUT):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        s.connect(self.rpc_path(worker))
+        return s
+
+    def sync_routing_state(self):
+        while self.running:
+            try:
+                with self.sibling(0, chord.CONNECTION_TIMEOUT) as s:
+                    s.send(json.dumps({"command": "get_routing_state"}).encode())
+                    frame = chord.recv_frame(s, chord.BATCH_FRAME_LIMIT)
+                    self.apply_routing_state(json.loads(frame.decode()))
+            except Exception as e:
+                # A worker that stops syncing routes with a stale view of the ring
+                print(f"Routing state sync from worker 0 failed: {e}")
+            time.sleep(SYNC_INTERVAL)
+
+    def store_key_value(self, key, value):
+        shard = self.shard_of(key)
+        if shard == self.worker:
+            return super().store_key_value(key, value)
+        self.sibling_store_batch(shard, [(key, value)])
+
+    def store_many(self, items, if_absent=False):
+        by_shard = {}
+        for key, value in items:
+            by_shard.setdefault(self.shard_of(key), []).append((key, value))
+        local = by_shard.pop(self.worker, [])
+        if local:
+            super().store_many(local, if_absent)
+        for shard, shard_items in by_shard.items():
+            self.sibling_store_batch(shard, shard_items, if_absent)
+
+    def sibling_store_batch(self, shard, items, if_absent=False):
+        with self.sibling(shard) as s:
+            s.sendall(json.dumps({"command": "store_batch", "if_absent": if_absent}).encode())
+            chord.recv_json_frame(s)
+            chord.send_json_frame(s, {"items": items})
+            result = chord.recv_json_frame(s)
+            chord.send_frame(s, b"")
+        if result.get("status") != "success" or result.get("failed"):
+            raise RuntimeError(f"Worker {shard} failed to store batch: {result}")
+
+    def handle_dump_keys(self, conn, request):
+        """Dump this worker's shard, then relay every sibling's shard"""
+        if request.get("local"):
+            return super().handle_dump_keys(conn, request)
+        conn.settimeout(chord.STREAM_TIMEOUT)
+        header, frames = self.dump_local()
+        siblings = []
+        try:
+            for worker in range(self.workers):
+                if worker == self.worker:
+                    continue
+                s = self.sibling(worker)
+                siblings.append(s)
+                s.sendall(json.dumps({"command": "dump_keys", "local": True}).encode())
+                sibling_header = chord.recv_json_frame(s)
+                header["keys"] += sibling_header.get("keys", 0)
+                header["streamed_values"] += sibling_header.get("streamed_values", 0)
+            chord.send_json_frame(conn, header)
+            for frame in frames:
+                chord.send_frame(conn, frame)
+            for s in siblings:
+                while True:
+                    frame = chord.recv_frame(s, chord.BATCH_FRAME_LIMIT)
+                    if not frame:
+                        break
+                    chord.send_frame(conn, frame)
+            chord.send_frame(conn, b"")
+        finally:
+            for s in siblings:
+                s.close()
+
+def run_worker(ip, port, worker, workers, sock_dir, known_node, m, data_dir):
+    node = ShardedNode(ip, port, worker, workers, sock_dir, m, data_dir)
+    for target in (node.receive_handoffs, node.serve_rpc):
+        threading.Thread(target=target, daemon=True).start()
+    # Let every sibling bind its sockets before connections start arriving
+    time.sleep(0.2)
+
+    if worker == 0:
+        node.join(known_node)
+        threading.Thread(target=node.fix_fingers, daemon=True).start()
+        threading.Thread(target=node.stabilize_loop, daemon=True).start()
+    else:
+        threading.Thread(target=node.sync_routing_state, daemon=True).start()
+    node.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Chord node as several worker processes")
+    parser.add_argument("ip")
+    parser.add_argument("port", type=int)
+    parser.add_argument("known", nargs="*", help="known_ip known_port of a node to join")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bits", type=int, default=10)
+    parser.add_argument("--data-dir", default=chord.DATA_STORE_DIR)
+    # Intermixed, so the known node may follow options such as --workers
+    args = parser.parse_intermixed_args()
+    if len(args.known) not in (0, 2):
+        parser.error("give the node to join as both <known_ip> <known_port>")
+    known_node = (args.known[0], int(args.known[1])) if args.known else None
+
+    sock_dir = tempfile.mkdtemp(prefix=f"chord_{args.port}_")
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(args.ip, args.port, worker, args.workers, sock_dir, known_node,
+                  args.bits, args.data_dir),
+            daemon=True,
+        )
+        for worker in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    # Turn SIGTERM into a normal exit so the workers are stopped too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Node {args.ip}:{args.port} running with {args.workers} workers")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        shutil.rmtree(sock_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
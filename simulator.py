@@ -0,0 +1,664 @@
+"""In-process network simulator for running many Chord nodes at once.
+
+Every node is a regular node.Node wired to an InMemoryNetwork instead of TCP,
+so hundreds or thousands of nodes fit in one process. The network injects a
+configurable one-way latency (a constant or a function of the two endpoints)
+and connection loss, which lets us measure lookup hop counts and how quickly
+finger tables converge without spawning a process per node.
+
+Usage: python simulator.py [--nodes N] [--bits M] [--latency-ms L] [--loss P]
+                           [--racks R --cross-rack-ms X] [--compare-proximity]
+                           [--rebalance] [--anti-entropy]
+                           [--churn [--failures F] [--stabilize-ms S]]
+                           [--hedge [--straggler-fraction P] [--straggler-ms X]]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import node as chord
+
+CLIENT = ("client", 0)  # Source address of requests from outside the ring
+
+class _Pipe:
+    """One direction of a simulated connection: bytes become readable once
+    their delivery time has passed. An empty chunk marks end of stream."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = deque()
+
+    def write(self, data, deliver_at):
+        with self.cond:
+            self.chunks.append((deliver_at, bytes(data)))
+            self.cond.notify_all()
+
+    def read(self, size, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                wait = None if deadline is None else deadline - now
+                if self.chunks:
+                    deliver_at, data = self.chunks[0]
+                    if deliver_at <= now:
+                        if not data:
+                            return b""
+                        if len(data) <= size:
+                            self.chunks.popleft()
+                            return data
+                        self.chunks[0] = (deliver_at, data[size:])
+                        return data[:size]
+                    wait = deliver_at - now if wait is None else min(wait, deliver_at - now)
+                if wait is not None and wait <= 0:
+                    raise socket.timeout("timed out")
+                self.cond.wait(wait)
+
+class SimulatedConnection:
+    """Socket-like endpoint returned by SimulatedTransport"""
+
+    def __init__(self, inbound, outbound, delay):
+        self.inbound = inbound
+        self.outbound = outbound
+        self.delay = delay
+        self.timeout = None
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def sendall(self, data):
+        if self.closed:
+            raise OSError("Connection closed")
+        self.outbound.write(data, time.monotonic() + self.delay)
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def recv(self, size):
+        return self.inbound.read(size, self.timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.outbound.write(b"", time.monotonic() + self.delay)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SimulatedListener:
+    def __init__(self, network, addr):
+        self.network = network
+        self.addr = addr
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.closed = False
+
+    def accept(self):
+        with self.cond:
+            while not self.pending:
+                if self.closed:
+                    raise OSError("Listener closed")
+                self.cond.wait()
+            return self.pending.popleft()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.network.unlisten(self.addr, self)
+
+class InMemoryNetwork:
+    """Connects SimulatedTransports by address.
+
+    latency is the one-way delay in seconds, either a number or a callable
+    latency(src, dst). loss is the probability that a connection attempt is
+    dropped, which the caller observes as a timeout.
+    """
+
+    def __init__(self, latency=0.0, loss=0.0, seed=None):
+        self.latency = latency
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.listeners = {}
+        self.connections = 0
+
+    def transport(self, addr):
+        return SimulatedTransport(self, tuple(addr))
+
+    def one_way(self, src, dst):
+        return self.latency(src, dst) if callable(self.latency) else self.latency
+
+    def listen(self, addr):
+        with self.lock:
+            if addr in self.listeners:
+                raise OSError(f"Address {addr} already in use")
+            listener = SimulatedListener(self, addr)
+            self.listeners[addr] = listener
+            return listener
+
+    def unlisten(self, addr, listener):
+        with self.lock:
+            if self.listeners.get(addr) is listener:
+                del self.listeners[addr]
+
+    def connect(self, src, dst, timeout):
+        dst = tuple(dst)
+        delay = self.one_way(src, dst)
+        with self.lock:
+            listener = self.listeners.get(dst)
+            dropped = self.loss and self.rng.random() < self.loss
+            self.connections += 1
+        if dropped:
+            time.sleep(timeout or 0)
+            raise socket.timeout("timed out")
+        # A connection costs one round trip before data can flow
+        time.sleep(2 * delay)
+        if listener is None:
+            raise ConnectionRefusedError(f"Connection refused by {dst}")
+        to_server, to_client = _Pipe(), _Pipe()
+        client = SimulatedConnection(to_client, to_server, delay)
+        client.settimeout(timeout)
+        server = SimulatedConnection(to_server, to_client, delay)
+        with listener.cond:
+            if listener.closed:
+                raise ConnectionRefusedError(f"Connection refused by {dst}")
+            listener.pending.append((server, src))
+            listener.cond.notify_all()
+        return client
+
+class SimulatedTransport:
+    """Transport bound to one source address on an InMemoryNetwork"""
+
+    def __init__(self, network, addr):
+        self.network = network
+        self.addr = addr
+
+    def listen(self, addr, backlog=5):
+        return self.network.listen(tuple(addr))
+
+    def connect(self, addr, timeout):
+        return self.network.connect(self.addr, addr, timeout)
+
+def rack_latency(racks, local, remote, seed=0):
+    """Latency function placing each address in one of several racks.
+
+    Links inside a rack cost local seconds one way and links between racks
+    cost remote, which is the setting proximity routing is meant for.
+    """
+    def rack_of(addr):
+        return chord.hash_function(f"{seed}:{addr[0]}:{addr[1]}", 32) % racks
+
+    def latency(src, dst):
+        return local if rack_of(src) == rack_of(dst) else remote
+    return latency
+
+def straggler_latency(base, fraction, extra, seed=0):
+    """Latency function that makes a fraction of connections extra seconds slower.
+
+    base is a number or another latency function. The draw is made per
+    connection, which models a peer stalling now and then (a GC pause, a
+    busy disk) rather than one that is always slow. Connections from
+    CLIENT are left alone, since only the ring's side of a read can be
+    hedged.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def latency(src, dst):
+        with lock:
+            slow = src != CLIENT and rng.random() < fraction
+        return (base(src, dst) if callable(base) else base) + (extra if slow else 0.0)
+    return latency
+
+class Simulation:
+    """A ring of simulated nodes plus helpers to measure it"""
+
+    def __init__(self, network, bits=16, quiet=True, workers=32):
+        self.network = network
+        self.bits = bits
+        self.quiet = quiet
+        self.workers = workers
+        self.nodes = {}
+        self.rng = random.Random(network.rng.random())
+        self.stabilizing = False
+
+    def _output(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+    def next_address(self):
+        # Skip addresses whose id collides with a node already in the ring
+        used = {n.node_id for n in self.nodes.values()}
+        i = len(self.nodes)
+        while True:
+            addr = (f"10.{i // 250 % 250}.{i % 250}.1", 8000 + i // 62500)
+            if addr not in self.nodes and chord.hash_function(f"{addr[0]}:{addr[1]}", self.bits) not in used:
+                return addr
+            i += 1
+
+    def add_node(self, addr=None):
+        addr = addr or self.next_address()
+        with self._output():
+            n = chord.Node(addr[0], addr[1], self.bits,
+                           transport=self.network.transport(addr), data_dir=None)
+            threading.Thread(target=n.serve_forever, daemon=True).start()
+            while addr not in self.network.listeners:
+                time.sleep(0.001)
+            if self.nodes:
+                known = self.rng.choice(list(self.nodes))
+                n.join(known)
+            else:
+                n.join()
+        self.nodes[addr] = n
+        if self.stabilizing:
+            threading.Thread(target=n.stabilize_loop, daemon=True).start()
+        return n
+
+    def start_stabilizing(self):
+        """Run every node's stabilize loop in the background from now on.
+
+        The loops print from their own threads, so callers that want quiet
+        output keep a _output() block open for as long as they run.
+        """
+        self.stabilizing = True
+        for n in self.nodes.values():
+            threading.Thread(target=n.stabilize_loop, daemon=True).start()
+
+    def remove_node(self, addr):
+        """Crash a node: it stops answering without telling anyone"""
+        self.nodes.pop(addr).stop()
+
+    def build(self, count):
+        for _ in range(count):
+            self.add_node()
+
+    def ideal_successor(self, id_):
+        ids = sorted((n.node_id, addr) for addr, n in self.nodes.items())
+        for node_id, addr in ids:
+            if node_id >= id_:
+                return addr
+        return ids[0][1]
+
+    def correct_successors(self):
+        """Fraction of nodes whose successor pointer matches the ideal ring"""
+        good = sum(
+            1 for n in self.nodes.values()
+            if n.successor == self.ideal_successor((n.node_id + 1) % 2 ** self.bits)
+        )
+        return good / len(self.nodes)
+
+    def correct_predecessors(self):
+        """Fraction of nodes whose predecessor pointer matches the ideal ring"""
+        ordered = sorted(self.nodes.values(), key=lambda n: n.node_id)
+        good = sum(1 for i, n in enumerate(ordered) if n.predecessor == ordered[i - 1].address)
+        return good / len(ordered)
+
+    def wait_converged(self, timeout=60.0):
+        """Seconds until every successor and predecessor is correct, or None"""
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            if self.correct_successors() == 1.0 and self.correct_predecessors() == 1.0:
+                return time.monotonic() - start
+            time.sleep(0.01)
+        return None
+
+    def correct_fingers(self):
+        """Fraction of finger entries that point at the ideal node"""
+        good = total = 0
+        for n in self.nodes.values():
+            for i in range(self.bits):
+                total += 1
+                if n.fingers.get_finger(i) == self.ideal_successor(n.fingers.get_finger_start(i)):
+                    good += 1
+        return good / total
+
+    def repair_ring(self):
+        """Set every successor and predecessor from global knowledge.
+
+        This is an oracle, not a protocol: it lets routing experiments start
+        from a correct ring regardless of how joins went.
+        """
+        ordered = sorted(self.nodes.values(), key=lambda n: n.node_id)
+        for i, n in enumerate(ordered):
+            n.successor = ordered[(i + 1) % len(ordered)].address
+            n.predecessor = ordered[i - 1].address
+            n.is_standalone = False
+
+    def fix_all_fingers(self):
+        """One maintenance round: every node refreshes every finger"""
+        def fix(n):
+            for i in range(self.bits):
+                n.fix_finger(i)
+        with self._output(), ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(fix, list(self.nodes.values())))
+
+    def converge(self, max_rounds=20):
+        """Run maintenance rounds until the finger tables stop improving"""
+        start = time.monotonic()
+        history = [self.correct_fingers()]
+        for _ in range(max_rounds):
+            if history[-1] == 1.0:
+                break
+            self.fix_all_fingers()
+            history.append(self.correct_fingers())
+            if history[-1] <= history[-2]:
+                break
+        return {"rounds": len(history) - 1, "seconds": time.monotonic() - start,
+                "finger_accuracy": history}
+
+    def measure_lookups(self, count):
+        """Run random lookups from random nodes and summarise hops and latency"""
+        addrs = list(self.nodes)
+        jobs = [(self.nodes[self.rng.choice(addrs)], self.rng.randrange(2 ** self.bits))
+                for _ in range(count)]
+
+        def run(job):
+            origin, id_ = job
+            start = time.monotonic()
+            succ, hop_count = origin.lookup(id_)
+            return succ == self.ideal_successor(id_), hop_count, time.monotonic() - start
+
+        with self._output(), ThreadPoolExecutor(self.workers) as pool:
+            results = list(pool.map(run, jobs))
+        correct = sum(1 for ok, _, _ in results if ok)
+        hops = [hop_count for _, hop_count, _ in results]
+        latencies = [elapsed for _, _, elapsed in results]
+        return {
+            "lookups": count,
+            "correct": correct / count,
+            "mean_hops": statistics.mean(hops),
+            "p50_hops": percentile(hops, 50),
+            "p99_hops": percentile(hops, 99),
+            "max_hops": max(hops),
+            "mean_latency_ms": statistics.mean(latencies) * 1000,
+            "p99_latency_ms": percentile(latencies, 99) * 1000,
+        }
+
+    def client_request(self, addr, request):
+        """Send one legacy JSON request to addr as an outside client would"""
+        with self.network.connect(CLIENT, addr, chord.STREAM_TIMEOUT) as s:
+            s.send(json.dumps(request).encode())
+            return json.loads(s.recv(4096).decode())
+
+    def owner_of(self, key):
+        return self.ideal_successor(chord.hash_function(key, self.bits))
+
+    def request_shares(self, keys):
+        """Fraction of requests for keys that land on each owner"""
+        counts = {}
+        for key in keys:
+            owner = self.owner_of(key)
+            counts[owner] = counts.get(owner, 0) + 1
+        return {addr: count / len(keys) for addr, count in counts.items()}
+
+    def misplaced_keys(self):
+        """Stored copies held by a node that does not own the key"""
+        return sum(1 for addr, n in self.nodes.items() for key in n.data_store
+                   if self.owner_of(key) != addr)
+
+    def shutdown(self):
+        for n in self.nodes.values():
+            n.stop()
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def print_lookup_stats(label, stats):
+    print(f"{label}: {stats['lookups']} lookups, correct {stats['correct']:.1%}, "
+          f"hops mean {stats['mean_hops']:.2f} p99 {stats['p99_hops']}, "
+          f"latency mean {stats['mean_latency_ms']:.2f} ms p99 {stats['p99_latency_ms']:.2f} ms")
+
+def compare_proximity(sim, lookups):
+    """Report lookup latency with greedy and with proximity-aware routing"""
+    sim.repair_ring()
+    chord.PROXIMITY_ROUTING = True
+    # Fill finger candidates and RTT estimates; converge() runs the
+    # same fix_finger maintenance the nodes run in the background
+    sim.converge()
+    chord.PROXIMITY_ROUTING = False
+    print_lookup_stats("Greedy routing", sim.measure_lookups(lookups))
+    chord.PROXIMITY_ROUTING = True
+    print_lookup_stats("Proximity routing", sim.measure_lookups(lookups))
+
+def rebalance_skew(sim, keys, reads, rounds):
+    """Skew reads onto one node's range and let rebalancing spread them.
+
+    Reports the busiest node's share of reads before and after each round,
+    then reads every key back through random nodes to check that nothing
+    was lost while keys were being handed over.
+    """
+    sim.repair_ring()
+    sim.converge()
+    data = {f"key{i}": f"value{i}" for i in range(keys)}
+    with sim._output():
+        for key, value in data.items():
+            sim.nodes[sim.owner_of(key)].store_key_value(key, value)
+    hot_owner = sim.owner_of(sim.rng.choice(list(data)))
+    hot_keys = [key for key in data if sim.owner_of(key) == hot_owner]
+    workload = [sim.rng.choice(hot_keys) if sim.rng.random() < 0.8 else sim.rng.choice(list(data))
+                for _ in range(reads)]
+    print(f"Busiest node before rebalancing: {max(sim.request_shares(workload).values()):.1%} of reads")
+
+    for round_ in range(1, rounds + 1):
+        with sim._output(), ThreadPoolExecutor(sim.workers) as pool:
+            list(pool.map(lambda key: sim.client_request(
+                sim.owner_of(key), {"command": "retrieve_key", "key": key}), workload))
+            moved = sum(1 for n in list(sim.nodes.values()) if n.rebalance_once())
+            while any(n.rebalancing for n in sim.nodes.values()):
+                time.sleep(0.05)
+        sim.converge()
+        print(f"Round {round_}: {moved} boundaries moved, busiest node "
+              f"{max(sim.request_shares(workload).values()):.1%} of reads")
+
+    addrs = list(sim.nodes)
+    with sim._output():
+        found = sum(
+            1 for key, value in data.items()
+            if sim.client_request(sim.rng.choice(addrs),
+                                  {"command": "retrieve_key", "key": key}).get("value") == value
+        )
+    print(f"Keys readable after rebalancing: {found}/{len(data)}")
+
+def anti_entropy(sim, keys, joins):
+    """Measure how anti-entropy moves keys after joins and with divergence.
+
+    First nodes join a ring that already holds data; notify hands each new
+    node its range. Then one node is given a stale copy of a neighbor's
+    range with a growing number of differences, and the time and keys
+    needed to reconcile it are reported.
+    """
+    sim.repair_ring()
+    sim.converge()
+    data = {f"key{i}": f"value{i}" for i in range(keys)}
+    with sim._output():
+        for key, value in data.items():
+            sim.nodes[sim.owner_of(key)].store_key_value(key, value)
+        for _ in range(joins):
+            sim.add_node()
+        deadline = time.monotonic() + 10
+        while sim.misplaced_keys() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    print(f"After {joins} joins: {sim.misplaced_keys()} of {keys} keys held by a non-owner")
+
+    sim.repair_ring()
+    ordered = sorted(sim.nodes.values(), key=lambda n: n.node_id)
+    owner = max(ordered, key=lambda n: len(n.data_store))
+    holder = ordered[ordered.index(owner) - 1]
+    owned = list(owner.data_store)
+    for divergence in (0, 1, 10, 100, len(owned)):
+        divergence = min(divergence, len(owned))
+        with sim._output():
+            holder.store_many([(key, data[key]) for key in owned])
+            owner.remove_many(owned[:divergence])
+            start = time.monotonic()
+            sent = holder.reconcile_range(owner.address)
+        print(f"{len(owned)} stale copies, {divergence} differing: sent {sent} keys "
+              f"in {(time.monotonic() - start) * 1000:.1f} ms")
+
+def churn(sim, nodes, failures, lookups):
+    """Measure how long stabilize takes to repair the ring after churn.
+
+    The ring is built with stabilize already running, as it would be in a
+    deployment, then loses failures nodes at once and gains as many.
+    """
+    out = sys.stdout
+
+    def report(label, seconds):
+        state = (f"converged in {seconds:.2f}s" if seconds is not None else
+                 f"not converged: successors {sim.correct_successors():.1%}, "
+                 f"predecessors {sim.correct_predecessors():.1%}")
+        print(f"{label}: {state}", file=out, flush=True)
+
+    with sim._output():
+        sim.start_stabilizing()
+        start = time.monotonic()
+        sim.build(nodes)
+        report(f"Ring of {nodes} nodes (joins taking {time.monotonic() - start:.2f}s)",
+               sim.wait_converged())
+
+        for addr in sim.rng.sample(list(sim.nodes), failures):
+            sim.remove_node(addr)
+        report(f"After {failures} simultaneous failures", sim.wait_converged())
+
+        start = time.monotonic()
+        for _ in range(failures):
+            sim.add_node()
+        report(f"After {failures} joins (taking {time.monotonic() - start:.2f}s)", sim.wait_converged())
+
+        sim.converge()
+        stats = sim.measure_lookups(lookups)
+        sim.shutdown()
+    print_lookup_stats("Lookups after churn", stats)
+
+def hedged_reads(sim, keys, reads):
+    """Compare client read latency without and with hedged reads.
+
+    The unhedged pass also gives every node the read latency history its
+    hedge delay is computed from.
+    """
+    sim.repair_ring()
+    sim.converge()
+    data = {f"key{i}": f"value{i}" for i in range(keys)}
+    with sim._output():
+        for key, value in data.items():
+            sim.nodes[sim.owner_of(key)].store_key_value(key, value)
+    addrs, names = list(sim.nodes), list(data)
+
+    def run(job):
+        addr, key = job
+        start = time.monotonic()
+        response = sim.client_request(addr, {"command": "retrieve_key", "key": key})
+        return response.get("value") == data[key], time.monotonic() - start
+
+    for hedged in (False, True):
+        for n in sim.nodes.values():
+            n.hedged_reads = hedged
+        sent = sum(n.hedges for n in sim.nodes.values())
+        jobs = [(sim.rng.choice(addrs), sim.rng.choice(names)) for _ in range(reads)]
+        # Few concurrent clients, so queueing in this one process does not
+        # swamp the network delays being measured
+        with sim._output(), ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(run, jobs))
+        latencies = [elapsed * 1000 for _, elapsed in results]
+        print(f"{'Hedged' if hedged else 'Unhedged'} reads: "
+              f"correct {sum(ok for ok, _ in results) / reads:.1%}, "
+              f"latency p50 {percentile(latencies, 50):.1f} ms p99 {percentile(latencies, 99):.1f} ms "
+              f"max {max(latencies):.1f} ms, "
+              f"{sum(n.hedges for n in sim.nodes.values()) - sent} hedges sent")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a Chord ring in one process")
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--bits", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--racks", type=int, default=0,
+                        help="spread nodes over racks; --latency-ms is then the in-rack latency")
+    parser.add_argument("--cross-rack-ms", type=float, default=5.0)
+    parser.add_argument("--compare-proximity", action="store_true",
+                        help="measure lookup latency with and without proximity routing")
+    parser.add_argument("--rebalance", action="store_true",
+                        help="skew reads onto one node and measure load-aware rebalancing")
+    parser.add_argument("--anti-entropy", action="store_true",
+                        help="measure key handover after joins and Merkle reconciliation cost")
+    parser.add_argument("--churn", action="store_true",
+                        help="measure ring convergence under stabilize after failures and joins")
+    parser.add_argument("--failures", type=int, default=None,
+                        help="nodes to crash in --churn (default: a tenth of the ring)")
+    parser.add_argument("--stabilize-ms", type=float, default=100.0)
+    parser.add_argument("--hedge", action="store_true",
+                        help="compare read tail latency with and without hedged reads")
+    parser.add_argument("--straggler-fraction", type=float, default=0.002,
+                        help="share of connections slowed down in --hedge")
+    parser.add_argument("--straggler-ms", type=float, default=100.0)
+    parser.add_argument("--keys", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    if args.racks:
+        latency = rack_latency(args.racks, latency, args.cross_rack_ms / 1000, args.seed)
+    if args.hedge:
+        latency = straggler_latency(latency, args.straggler_fraction,
+                                    args.straggler_ms / 1000, args.seed)
+    network = InMemoryNetwork(latency=latency, loss=args.loss, seed=args.seed)
+    sim = Simulation(network, bits=args.bits)
+
+    if args.churn:
+        chord.STABILIZE_INTERVAL = args.stabilize_ms / 1000
+        failures = args.failures if args.failures is not None else max(1, args.nodes // 10)
+        churn(sim, args.nodes, failures, args.lookups)
+        return
+
+    start = time.monotonic()
+    sim.build(args.nodes)
+    print(f"Joined {args.nodes} nodes in {time.monotonic() - start:.1f}s")
+    if args.compare_proximity:
+        compare_proximity(sim, args.lookups)
+        sim.shutdown()
+        return
+    if args.anti_entropy:
+        anti_entropy(sim, args.keys, max(1, args.nodes // 2))
+        sim.shutdown()
+        return
+    if args.rebalance:
+        rebalance_skew(sim, args.keys, args.lookups, args.rounds)
+        sim.shutdown()
+        return
+    if args.hedge:
+        hedged_reads(sim, args.keys, args.lookups)
+        sim.shutdown()
+        return
+    print(f"Correct successors after joins: {sim.correct_successors():.1%}")
+    # Joins alone leave most predecessors pointing past the newcomer, and
+    # hop counts only mean something on a correct ring
+    sim.repair_ring()
+    print(f"Correct successors after repair: {sim.correct_successors():.1%}")
+
+    convergence = sim.converge()
+    print(f"Finger convergence: {convergence['rounds']} rounds in {convergence['seconds']:.1f}s, "
+          f"accuracy {' -> '.join(f'{a:.1%}' for a in convergence['finger_accuracy'])}")
+
+    print_lookup_stats("Lookups", sim.measure_lookups(args.lookups))
+    print(f"Connections opened: {network.connections}")
+    sim.shutdown()
+
+if __name__ == "__main__":
+    main()
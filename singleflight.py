@@ -0,0 +1,55 @@
+import threading
+
+class FlightTimeout(TimeoutError):
+    """A waiting caller gave up before the shared call finished"""
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still in flight wait and receive the same result (or exception).
+    Nothing is cached once the call finishes, so a request that starts after
+    the result came back always triggers a fresh call. A waiting caller may
+    pass its own timeout, after which it gets FlightTimeout while the call
+    goes on for the others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise FlightTimeout(f"Gave up waiting for {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
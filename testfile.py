@@ -1,4 +1,4 @@
-import node
+from node import Node
 import sys
 import threading
 import time
@@ -90,7 +90,7 @@ if __name__ == "__main__":
         sys.exit(1)
 
     ip, port = sys.argv[1], int(sys.argv[2])
-    node.init_node(ip, port)
+    node = Node(ip, port)
     
     if len(sys.argv) == 5:
         node.join((sys.argv[3], int(sys.argv[4])))
@@ -0,0 +1,380 @@
+"""Key/value store with a bounded memory tier over sorted on-disk segments.
+
+Writes are appended to a log and kept in memory until they add up to a
+fraction of the memory budget; then they are written out together as a
+new segment file sorted by key and the log starts over. Values read from
+disk are cached in a least-recently-used memory tier, which is trimmed to
+keep the memory tier within budget.
+
+Each segment keeps a Bloom filter of its keys and a sparse index holding
+every SPARSE_INDEX_INTERVAL-th key with its file offset. A lookup for a
+key that is not stored is normally answered by the filters without any
+disk read, and a cold key costs one seek and a scan of at most
+SPARSE_INDEX_INTERVAL records. Deletes are written as tombstones, which
+are dropped when all segments are merged into one. That merge runs on a
+background thread and only takes the lock to swap the merged segment in,
+so reads and writes carry on while it rewrites the data.
+
+Without a directory the store is a plain in-memory mapping.
+"""
+import bisect
+import hashlib
+import heapq
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes of values kept in memory
+FLUSH_FRACTION = 0.25  # Write a segment once unflushed writes reach this share of the budget
+SPARSE_INDEX_INTERVAL = 32  # Records between sparse index entries
+BLOOM_BITS_PER_KEY = 10  # About 1% false positives with BLOOM_HASHES hashes
+BLOOM_HASHES = 7
+MAX_SEGMENTS = 8  # Merge every segment into one beyond this many
+
+_ABSENT = object()
+_TOMBSTONE = object()
+
+def encode_record(key, value):
+    """One segment or log line: JSON key, then a tab and JSON value unless deleted"""
+    if value is _TOMBSTONE:
+        return json.dumps(key).encode() + b"\n"
+    return json.dumps(key).encode() + b"\t" + json.dumps(value).encode() + b"\n"
+
+def decode_record(line):
+    key, tab, value = line.partition(b"\t")
+    return json.loads(key), (json.loads(value) if tab else _TOMBSTONE)
+
+def record_key(line):
+    # JSON escapes tabs inside strings, so the first tab ends the key
+    return json.loads(line.partition(b"\t")[0])
+
+class BloomFilter:
+    def __init__(self, capacity, bits_per_key=BLOOM_BITS_PER_KEY, hashes=BLOOM_HASHES):
+        self.size = max(64, capacity * bits_per_key)
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+class Segment:
+    """One immutable segment file with its Bloom filter and sparse index"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_keys = []
+        self.index_offsets = []
+        keys = []
+        offset = 0
+        with open(path, "rb") as f:
+            for i, line in enumerate(f):
+                key = record_key(line)
+                if i % SPARSE_INDEX_INTERVAL == 0:
+                    self.index_keys.append(key)
+                    self.index_offsets.append(offset)
+                keys.append(key)
+                offset += len(line)
+        self.bloom = BloomFilter(len(keys))
+        for key in keys:
+            self.bloom.add(key)
+        self.file = open(path, "rb")
+
+    @classmethod
+    def create(cls, path, records):
+        """Write (key, value) records, already sorted by key, as a segment"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            for key, value in records:
+                f.write(encode_record(key, value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return cls(path)
+
+    def get(self, key):
+        """(value, record size), (_TOMBSTONE, size) or (_ABSENT, 0)"""
+        if key not in self.bloom:
+            return _ABSENT, 0
+        i = bisect.bisect_right(self.index_keys, key) - 1
+        if i < 0:
+            return _ABSENT, 0
+        self.file.seek(self.index_offsets[i])
+        for _ in range(SPARSE_INDEX_INTERVAL):
+            line = self.file.readline()
+            if not line:
+                break
+            line_key = record_key(line)
+            if line_key == key:
+                return decode_record(line)[1], len(line)
+            if line_key > key:
+                break
+        return _ABSENT, 0
+
+    def records(self):
+        """Iterator over (key, value) records; the file is opened right away"""
+        f = open(self.path, "rb")
+
+        def read():
+            with f:
+                for line in f:
+                    yield decode_record(line)
+        return read()
+
+    def remove(self):
+        self.file.close()
+        os.remove(self.path)
+
+def merge_records(sources):
+    """Merge sorted (key, value) iterables, newest first, keeping each key's newest record"""
+    ranked = [((key, rank, value) for key, value in source) for rank, source in enumerate(sources)]
+    last = _ABSENT
+    for key, _, value in heapq.merge(*ranked, key=lambda record: record[:2]):
+        if key != last:
+            last = key
+            yield key, value
+
+class TieredStore(MutableMapping):
+    """Mapping of keys to JSON values held partly in memory and partly on disk"""
+
+    def __init__(self, directory=None, memory_budget=MEMORY_BUDGET):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.lock = threading.RLock()
+        self.dirty = OrderedDict()  # key -> (value, size) written since the last flush
+        self.clean = OrderedDict()  # key -> (value, size) cached from disk, least recent first
+        self.dirty_bytes = 0
+        self.clean_bytes = 0
+        self.segments = []  # oldest first
+        self.next_segment = 0
+        self.count = 0
+        self.log = None
+        self.log_bytes = 0
+        self.compactor = None
+        if directory:
+            self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._finish_compaction()
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.startswith("segment_") and name.endswith(".dat"):
+                self.segments.append(Segment(path))
+                self.next_segment = int(name[len("segment_"):-len(".dat")]) + 1
+        self.count = sum(1 for _, value in self._segment_records() if value is not _TOMBSTONE)
+
+        # Replay writes that had not reached a segment yet
+        log_path = os.path.join(self.directory, "log.dat")
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                for line in f:
+                    if line.endswith(b"\n"):
+                        self._put(*decode_record(line), log=False)
+        self.log = open(log_path, "ab")
+        self.log_bytes = self.log.tell()
+        self.flush()
+
+    def _segment_records(self):
+        return merge_records([segment.records() for segment in reversed(self.segments)])
+
+    def _lookup(self, key, cache=True):
+        entry = self.dirty.get(key)
+        if entry is not None:
+            return entry[0]
+        entry = self.clean.get(key)
+        if entry is not None:
+            self.clean.move_to_end(key)
+            return entry[0]
+        for segment in reversed(self.segments):
+            value, size = segment.get(key)
+            if value is not _ABSENT:
+                if cache:
+                    self.clean[key] = (value, size)
+                    self.clean_bytes += size
+                    self._trim()
+                return value
+        return _ABSENT
+
+    def _put(self, key, value, log=True):
+        line = encode_record(key, value)
+        if log and self.log:
+            self.log.write(line)
+            self.log_bytes += len(line)
+        previous = self._lookup(key, cache=False)
+        existed = previous is not _ABSENT and previous is not _TOMBSTONE
+        if value is _TOMBSTONE:
+            self.count -= existed
+        else:
+            self.count += not existed
+
+        entry = self.clean.pop(key, None)
+        if entry is not None:
+            self.clean_bytes -= entry[1]
+        entry = self.dirty.pop(key, None)
+        if entry is not None:
+            self.dirty_bytes -= entry[1]
+        if not self.directory:
+            if value is not _TOMBSTONE:
+                self.clean[key] = (value, len(line))
+            return
+        self.dirty[key] = (value, len(line))
+        self.dirty_bytes += len(line)
+        # Overwrites of hot keys grow the log without growing dirty_bytes
+        if self.log and (self.dirty_bytes >= self.memory_budget * FLUSH_FRACTION
+                         or self.log_bytes >= self.memory_budget):
+            self.flush()
+        self._trim()
+
+    def _trim(self):
+        while self.clean and self.clean_bytes + self.dirty_bytes > self.memory_budget:
+            _, (_, size) = self.clean.popitem(last=False)
+            self.clean_bytes -= size
+
+    def flush(self):
+        """Write unflushed writes out as a new segment and start a fresh log"""
+        with self.lock:
+            if not self.directory or not self.dirty:
+                return
+            path = os.path.join(self.directory, f"segment_{self.next_segment:08d}.dat")
+            self.next_segment += 1
+            records = sorted((key, value) for key, (value, _) in self.dirty.items())
+            self.segments.append(Segment.create(path, records))
+            # Flushed entries stay cached as the most recently used
+            self.clean.update(self.dirty)
+            self.clean_bytes += self.dirty_bytes
+            self.dirty = OrderedDict()
+            self.dirty_bytes = 0
+            self.log.close()
+            self.log = open(os.path.join(self.directory, "log.dat"), "wb")
+            self.log_bytes = 0
+            if len(self.segments) > MAX_SEGMENTS and self.compactor is None:
+                self.compactor = threading.Thread(target=self._compact_loop, daemon=True)
+                self.compactor.start()
+
+    def _compact_loop(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.segments) <= MAX_SEGMENTS or not self.log:
+                        self.compactor = None
+                        return
+                self._compact()
+        except Exception as e:
+            with self.lock:
+                self.compactor = None
+            print(f"Compaction of {self.directory} failed: {e}")
+
+    def _compact(self):
+        """Merge every current segment into one, dropping tombstones and old values.
+
+        Segments are immutable, so the merge reads them without the lock.
+        Segments flushed meanwhile are newer than everything merged and stay
+        in front of the result.
+        """
+        with self.lock:
+            inputs = list(self.segments)
+            number = self.next_segment
+            self.next_segment += 1
+            # The merged segment has no tombstones, so older segments must
+            # not outlive it; the marker lets a restart finish removing them
+            with open(os.path.join(self.directory, "compact.dat"), "w") as f:
+                f.write(str(number))
+            sources = [segment.records() for segment in reversed(inputs)]
+        path = os.path.join(self.directory, f"segment_{number:08d}.dat")
+        live = ((key, value) for key, value in merge_records(sources) if value is not _TOMBSTONE)
+        merged = Segment.create(path, live)
+        with self.lock:
+            self.segments = [merged] + self.segments[len(inputs):]
+            for segment in inputs:
+                segment.remove()
+            os.remove(os.path.join(self.directory, "compact.dat"))
+
+    def _finish_compaction(self):
+        marker = os.path.join(self.directory, "compact.dat")
+        if not os.path.exists(marker):
+            return
+        with open(marker) as f:
+            number = int(f.read())
+        if os.path.exists(os.path.join(self.directory, f"segment_{number:08d}.dat")):
+            for name in os.listdir(self.directory):
+                if (name.startswith("segment_") and name.endswith(".dat")
+                        and int(name[len("segment_"):-len(".dat")]) < number):
+                    os.remove(os.path.join(self.directory, name))
+        os.remove(marker)
+
+    def sync(self):
+        """Make every logged write durable"""
+        with self.lock:
+            if self.log:
+                self.log.flush()
+                os.fsync(self.log.fileno())
+
+    def close(self):
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+        with self.lock:
+            if self.log:
+                self.sync()
+                self.log.close()
+                self.log = None
+            for segment in self.segments:
+                segment.file.close()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self._lookup(key)
+        if value is _ABSENT or value is _TOMBSTONE:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        with self.lock:
+            value = self._lookup(key)
+        return value is not _ABSENT and value is not _TOMBSTONE
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self._put(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self:
+                raise KeyError(key)
+            self._put(key, _TOMBSTONE)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        """Snapshot iterator over (key, value) pairs in key order.
+
+        Memory entries are copied and segment files opened on the call, so
+        later writes do not show up and compaction cannot pull files away.
+        """
+        with self.lock:
+            memory = sorted((key, value) for key, (value, _) in
+                            list(self.clean.items()) + list(self.dirty.items()))
+            sources = [memory] + [segment.records() for segment in reversed(self.segments)]
+        return ((key, value) for key, value in merge_records(sources) if value is not _TOMBSTONE)
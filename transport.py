@@ -0,0 +1,19 @@
+import socket
+
+class TcpTransport:
+    """Default transport: plain TCP sockets.
+
+    A transport hands out socket-like connections. Anything providing
+    sendall/send/recv/settimeout/close (and use as a context manager) can
+    stand in, which is how the simulator runs many nodes in one process.
+    """
+
+    def listen(self, addr, backlog=5):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind(addr)
+        server_socket.listen(backlog)
+        return server_socket
+
+    def connect(self, addr, timeout):
+        return socket.create_connection(addr, timeout=timeout)